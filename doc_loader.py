@@ -33,33 +33,114 @@ test_documents = [
 ]
 
 # Import required libraries
+from collections import defaultdict
+from concurrent.futures import ThreadPoolExecutor
 from datetime import datetime
 import asyncio
+import functools
+import hashlib
 import openai
 from pinecone import Pinecone
 import os
 from typing import List, Dict, Any
 from dotenv import load_dotenv
+import re
 import tiktoken
-from langchain.text_splitter import MarkdownTextSplitter
+from langchain.text_splitter import MarkdownHeaderTextSplitter, RecursiveCharacterTextSplitter
 
 
-load_dotenv()
+@functools.lru_cache(maxsize=1)
+def get_openai_client() -> openai.AsyncOpenAI:
+    """Lazily construct the shared async OpenAI client on first use"""
+    load_dotenv()
+    return openai.AsyncOpenAI(api_key=os.getenv('OPENAI_API_KEY'))
 
-# Initialize OpenAI client
-client = openai.OpenAI(api_key=os.getenv('OPENAI_API_KEY'))
 
-# Initialize Pinecone
-pc = Pinecone(api_key=os.getenv('PINECONE_API_KEY'))
+@functools.lru_cache(maxsize=1)
+def get_pinecone() -> Pinecone:
+    """Lazily construct the shared Pinecone client on first use"""
+    load_dotenv()
+    return Pinecone(api_key=os.getenv('PINECONE_API_KEY'))
 
 
-encoding = tiktoken.get_encoding("cl100k_base")
+@functools.lru_cache(maxsize=1)
+def get_encoding():
+    """
+    Lazily load the cl100k_base encoding (parses a ~1.5MB BPE table)
+
+    Points TIKTOKEN_CACHE_DIR at a persistent location first so cold starts
+    reuse the downloaded BPE merges instead of re-fetching them; set the env
+    var yourself to override the cache location in production.
+    """
+    os.environ.setdefault("TIKTOKEN_CACHE_DIR", os.path.expanduser("~/.cache/tiktoken"))
+    os.makedirs(os.environ["TIKTOKEN_CACHE_DIR"], exist_ok=True)
+    return tiktoken.get_encoding("cl100k_base")
+
+# Compiled once; matches the patient ID digits embedded in filenames
+_PID_RE = re.compile(r'(\d+)')
+
+# Filename keyword -> document type, checked in order
+_TYPE_MAP = (
+    ('intake', 'patient_information'),
+    ('vitals', 'vital_signs'),
+    ('lab', 'lab_results'),
+    ('imaging', 'diagnostic_imaging'),
+    ('history', 'past_medical_history'),
+    ('transcript', 'transcript'),
+)
+
+# Maximum number of texts sent to OpenAI per embeddings request
+# (the endpoint accepts up to ~2048 inputs per call)
+EMBED_BATCH_SIZE = 512
+
+# Token budget per embeddings request; the endpoint rejects calls whose
+# summed input exceeds 300k tokens, so stay comfortably below it
+EMBED_TOKEN_BUDGET = 250_000
+
+# Matryoshka truncation: 512 dims keeps nearly all semantic quality at a
+# third of the storage and bandwidth of the default 1536. Must match the
+# index dimension and the query path in tools.js/ragTools.js.
+EMBEDDING_DIMENSIONS = 512
+
+@functools.lru_cache(maxsize=1)
+def _get_openai_semaphore() -> asyncio.Semaphore:
+    """
+    Lazily build the cap on in-flight OpenAI requests
+
+    Reading OPENAI_CONCURRENCY after load_dotenv() means a value set in
+    .env is honored (35 suits tier 1; raise it for higher tiers).
+    """
+    load_dotenv()
+    return asyncio.Semaphore(int(os.getenv("OPENAI_CONCURRENCY", "35")))
+
+# Retry budget for transient OpenAI failures (429s, connection drops)
+EMBED_MAX_RETRIES = 5
+
+# Maximum number of vectors sent to Pinecone per upsert request
+UPSERT_BATCH_SIZE = 100
+
+# Token counts memoized by content digest: 16-byte keys and int values,
+# so the cache never pins the chunk texts themselves in memory
+_token_count_cache: Dict[bytes, int] = {}
+_TOKEN_CACHE_MAX = 10_000
+
 
 def count_tokens(text: str) -> int:
     """
     Count the number of tokens in the given text using the cl100k_base encoding
+
+    Memoized so repeated content (chunk overlap regions, shared headers,
+    re-scans of the same file) skips the BPE pass entirely.
     """
-    return len(encoding.encode(text))
+    key = hashlib.blake2b(text.encode('utf-8'), digest_size=16).digest()
+    count = _token_count_cache.get(key)
+    if count is None:
+        if len(_token_count_cache) >= _TOKEN_CACHE_MAX:
+            _token_count_cache.clear()
+        # encode_ordinary skips special-token scanning, which pure counting
+        # never needs
+        count = _token_count_cache[key] = len(get_encoding().encode_ordinary(text))
+    return count
 
 def count_tokens_in_folder(folder_path: str = '_Ethan Rodriguez') -> Dict[str, int]:
     """
@@ -71,29 +152,27 @@ def count_tokens_in_folder(folder_path: str = '_Ethan Rodriguez') -> Dict[str, i
     Returns:
         Dict[str, int]: Dictionary mapping file paths to token counts
     """
-    import glob
-    
     token_counts = {}
     
     try:
-        # Get all markdown files in the folder
-        markdown_pattern = os.path.join(folder_path, "*.md")
-        markdown_files = glob.glob(markdown_pattern)
+        # Get all markdown files in the folder (scandir streams the single
+        # directory listing instead of fnmatch-filtering a glob)
+        markdown_files = [entry.path for entry in os.scandir(folder_path)
+                          if entry.is_file() and entry.name.endswith('.md')]
         
         print(f"🔍 Scanning folder: {folder_path}")
         print(f"📄 Found {len(markdown_files)} markdown files")
         
-        for file_path in markdown_files:
-            try:
-                with open(file_path, 'r', encoding='utf-8') as file:
-                    content = file.read()
-                    token_count = count_tokens(content)
-                    token_counts[file_path] = token_count
-                    print(f"✅ {os.path.basename(file_path)}: {token_count} tokens")
-                    
-            except Exception as file_error:
-                print(f"❌ Error reading file {file_path}: {file_error}")
-                continue
+        # Read every file concurrently, then tokenize them in one batch
+        # call; tiktoken releases the GIL and spreads the BPE work across
+        # cores
+        contents_by_path = _read_files_parallel(markdown_files)
+        readable_files = list(contents_by_path)
+        token_lists = get_encoding().encode_ordinary_batch(
+            list(contents_by_path.values()), num_threads=os.cpu_count())
+        for file_path, tokens in zip(readable_files, token_lists):
+            token_counts[file_path] = len(tokens)
+            print(f"✅ {os.path.basename(file_path)}: {len(tokens)} tokens")
         
         # Print summary
         total_tokens = sum(token_counts.values())
@@ -107,24 +186,84 @@ def count_tokens_in_folder(folder_path: str = '_Ethan Rodriguez') -> Dict[str, i
         print(f"❌ Error scanning folder {folder_path}: {error}")
         return {}
 
-def split_markdown_text(markdown_text: str, chunk_size: int = 1000, chunk_overlap: int = 200) -> List[str]:
+def _read_file(file_path: str) -> str:
+    """Read one file as UTF-8 (helper for the parallel read paths)"""
+    with open(file_path, 'r', encoding='utf-8') as file:
+        return file.read()
+
+
+def _read_files_parallel(file_paths: List[str]) -> Dict[str, str]:
     """
-    Split markdown text into chunks using MarkdownTextSplitter
-    
+    Read many files concurrently on a thread pool
+
+    Overlaps the blocking reads so the kernel can service them together;
+    unreadable files are reported and skipped.
+
+    Args:
+        file_paths (List[str]): Paths to read
+
+    Returns:
+        Dict[str, str]: Mapping of path to file content, in input order
+    """
+    contents = {}
+    with ThreadPoolExecutor() as pool:
+        futures = {path: pool.submit(_read_file, path) for path in file_paths}
+        for path in file_paths:
+            try:
+                contents[path] = futures[path].result()
+            except Exception as file_error:
+                print(f"❌ Error reading file {path}: {file_error}")
+    return contents
+
+
+# Header levels the first splitting stage keys on
+_HEADERS_TO_SPLIT_ON = [('#', 'h1'), ('##', 'h2'), ('###', 'h3')]
+
+
+def split_markdown_text(markdown_text: str, chunk_size: int = 1000, chunk_overlap: int = 200) -> List[Dict[str, Any]]:
+    """
+    Split markdown text into header-aware chunks
+
+    Two-stage split: sections are cut on h1-h3 headers first so chunks stay
+    semantically coherent, then any oversized section is re-split by size.
+    Sizes are measured in cl100k_base tokens, so boundaries line up with
+    what the embedding model actually sees and chunks can never overrun the
+    model context because of a dense char-to-token ratio.
+
     Args:
         markdown_text (str): The markdown text to split
-        chunk_size (int): Maximum size of each chunk (default: 1000)
-        chunk_overlap (int): Overlap between chunks (default: 200)
-        
+        chunk_size (int): Maximum tokens per chunk (default: 1000)
+        chunk_overlap (int): Token overlap between chunks (default: 200)
+
     Returns:
-        List[str]: List of text chunks
+        List[Dict[str, Any]]: Chunks as dicts with 'text' (stripped),
+            'token_count', any 'h1'/'h2'/'h3' headers the chunk sits under,
+            and a joined 'section_path'
     """
-    markdown_splitter = MarkdownTextSplitter(
+    # strip_headers=False keeps the heading lines inside the chunk text, so
+    # a query matching only a section title still lands on its chunks
+    header_splitter = MarkdownHeaderTextSplitter(
+        headers_to_split_on=_HEADERS_TO_SPLIT_ON, strip_headers=False)
+    size_splitter = RecursiveCharacterTextSplitter.from_tiktoken_encoder(
+        encoding_name="cl100k_base",
         chunk_size=chunk_size,
         chunk_overlap=chunk_overlap
     )
 
-    chunks = markdown_splitter.split_text(markdown_text)
+    chunks = []
+    for section in header_splitter.split_text(markdown_text):
+        headers = section.metadata
+        section_path = ' > '.join(
+            headers[level] for level in ('h1', 'h2', 'h3') if level in headers
+        )
+        for piece in size_splitter.split_text(section.page_content):
+            stripped = piece.strip()
+            chunks.append({
+                'text': stripped,
+                'token_count': count_tokens(stripped),
+                'section_path': section_path,
+                **headers
+            })
     return chunks
 
 def process_all_markdown_files_in_folder(
@@ -145,27 +284,29 @@ def process_all_markdown_files_in_folder(
     Returns:
         List[Dict[str, Any]]: List of all document chunks from all files
     """
-    import glob
-    
     all_document_chunks = []
     
     try:
         # Get all markdown files in the folder
-        markdown_pattern = os.path.join(folder_path, "*.md")
-        markdown_files = glob.glob(markdown_pattern)
+        markdown_files = [entry.path for entry in os.scandir(folder_path)
+                          if entry.is_file() and entry.name.endswith('.md')]
         
         print(f"🔍 Processing folder: {folder_path}")
         print(f"📄 Found {len(markdown_files)} markdown files")
         
-        for file_path in markdown_files:
+        # Read every file concurrently up front, then process the contents
+        contents_by_path = _read_files_parallel(markdown_files)
+
+        for file_path, markdown_content in contents_by_path.items():
             print(f"\n📝 Processing: {os.path.basename(file_path)}")
-            
+
             # Process each file
             file_chunks = process_markdown_file(
                 file_path=file_path,
                 patient_id=patient_id,
                 chunk_size=chunk_size,
-                chunk_overlap=chunk_overlap
+                chunk_overlap=chunk_overlap,
+                markdown_content=markdown_content
             )
             
             # Add chunks to the master list
@@ -183,25 +324,31 @@ def process_all_markdown_files_in_folder(
         print(f"❌ Error processing folder {folder_path}: {error}")
         return []
 
-def process_markdown_file(file_path: str, patient_id: str = None, doc_type: str = None, chunk_size: int = 3000, chunk_overlap: int = 200) -> List[Dict[str, Any]]:
+def process_markdown_file(file_path: str, patient_id: str = None, doc_type: str = None, chunk_size: int = 3000, chunk_overlap: int = 200, markdown_content: str = None) -> List[Dict[str, Any]]:
     """
     Process a markdown file and return chunked document objects following the medical document schema
-    
+
     Args:
         file_path (str): Path to the markdown file
         patient_id (str): Patient identifier (if None, extracted from filename)
         doc_type (str): Document type (if None, extracted from filename or content)
         chunk_size (int): Maximum size of each chunk (default: 3000)
         chunk_overlap (int): Overlap between chunks (default: 200)
-        
+        markdown_content (str): File content, if the caller already read it
+            (avoids a second read when files are loaded in parallel)
+
     Returns:
         List[Dict[str, Any]]: List of document chunk objects following the schema
     """
     try:
-        # Read the markdown file
-        with open(file_path, 'r', encoding='utf-8') as file:
-            markdown_content = file.read()
-        
+        # Read the markdown file unless the caller supplied its content
+        if markdown_content is None:
+            markdown_content = _read_file(file_path)
+
+        # One timestamp for every chunk of this file; they are processed
+        # together
+        file_ts = datetime.now().isoformat()
+
         # Check token count first
         token_count = count_tokens(markdown_content)
         print(f"📊 File token count: {token_count}")
@@ -210,28 +357,16 @@ def process_markdown_file(file_path: str, patient_id: str = None, doc_type: str
         if not patient_id:
             filename = os.path.basename(file_path)
             # Try to extract patient ID from filename (assuming format like "patient_6789_intake.md")
-            import re
-            patient_match = re.search(r'(\d+)', filename)
+            patient_match = _PID_RE.search(filename)
             patient_id = patient_match.group(1) if patient_match else "unknown"
         
         # Extract document type from filename if not provided
         if not doc_type:
-            filename = os.path.basename(file_path)
-            # Try to extract type from filename or use default
-            if 'intake' in filename.lower():
-                doc_type = "patient_information"
-            elif 'vitals' in filename.lower():
-                doc_type = "vital_signs"
-            elif 'lab' in filename.lower():
-                doc_type = "lab_results"
-            elif 'imaging' in filename.lower():
-                doc_type = "diagnostic_imaging"
-            elif 'history' in filename.lower():
-                doc_type = "past_medical_history"
-            elif 'transcript' in filename.lower():
-                doc_type = "transcript"
-            else:
-                doc_type = "medical_document"
+            # Lowercase once and walk the keyword map instead of six
+            # separate .lower() scans
+            fn_lower = os.path.basename(file_path).lower()
+            doc_type = next((doc_type for keyword, doc_type in _TYPE_MAP
+                             if keyword in fn_lower), "medical_document")
         
         # If document is smaller than chunk_size, treat as single chunk
         if token_count <= chunk_size:
@@ -246,7 +381,7 @@ def process_markdown_file(file_path: str, patient_id: str = None, doc_type: str
                 "chunk_index": 0,
                 "total_chunks": 1,
                 "token_count": token_count,
-                "timestamp": datetime.now().isoformat(),
+                "timestamp": file_ts,
                 "source_file": os.path.basename(file_path),
                 "is_complete_document": True
             }
@@ -260,21 +395,24 @@ def process_markdown_file(file_path: str, patient_id: str = None, doc_type: str
             
             # Create document objects for each chunk
             document_chunks = []
-            for i, chunk_text in enumerate(chunks):
+            for i, chunk in enumerate(chunks):
                 # Generate unique doc_id for each chunk
                 doc_id = f"{patient_id}_{doc_type.replace(' ', '_').upper()}_{i}"
-                
                 document_chunk = {
                     "patient_id": patient_id,
                     "doc_id": doc_id,
                     "type": doc_type,
-                    "text": chunk_text.strip(),
+                    "text": chunk['text'],
                     "chunk_index": i,
                     "total_chunks": len(chunks),
-                    "token_count": count_tokens(chunk_text.strip()),
-                    "timestamp": datetime.now().isoformat(),
+                    # Token counts come back from the splitter pass
+                    "token_count": chunk['token_count'],
+                    "timestamp": file_ts,
                     "source_file": os.path.basename(file_path),
-                    "is_complete_document": False
+                    "is_complete_document": False,
+                    # Header context from the two-stage split
+                    "section_path": chunk['section_path'],
+                    **{level: chunk[level] for level in ('h1', 'h2', 'h3') if level in chunk}
                 }
                 document_chunks.append(document_chunk)
             
@@ -284,6 +422,222 @@ def process_markdown_file(file_path: str, patient_id: str = None, doc_type: str
         print(f"❌ Error processing markdown file {file_path}: {error}")
         return []
 
+
+def iter_markdown_chunks(
+    folder_path: str = '_Ethan Rodriguez',
+    patient_id: str = None,
+    chunk_size: int = 3000,
+    chunk_overlap: int = 200
+):
+    """
+    Yield document chunks file by file instead of materializing the corpus
+
+    Generator counterpart of process_all_markdown_files_in_folder: only one
+    file's chunks are in memory at a time, so large folders can stream
+    straight into the embed/upsert pipeline.
+
+    Args:
+        folder_path (str): Path to the folder containing markdown files
+        patient_id (str): Patient identifier (if None, extracted from filename)
+        chunk_size (int): Maximum size of each chunk (default: 3000)
+        chunk_overlap (int): Overlap between chunks (default: 200)
+
+    Yields:
+        Dict[str, Any]: Document chunk objects following the schema
+    """
+    try:
+        markdown_files = [entry.path for entry in os.scandir(folder_path)
+                          if entry.is_file() and entry.name.endswith('.md')]
+
+        print(f"🔍 Processing folder: {folder_path}")
+        print(f"📄 Found {len(markdown_files)} markdown files")
+
+        for file_path in markdown_files:
+            print(f"\n📝 Processing: {os.path.basename(file_path)}")
+            yield from process_markdown_file(
+                file_path=file_path,
+                patient_id=patient_id,
+                chunk_size=chunk_size,
+                chunk_overlap=chunk_overlap
+            )
+
+    except Exception as error:
+        print(f"❌ Error processing folder {folder_path}: {error}")
+
+
+def _doc_token_count(doc: Dict[str, Any]) -> int:
+    """Token count of one chunk, from the splitter pass or on demand"""
+    return doc.get('token_count') or count_tokens(doc['text'])
+
+
+def _batch_by_token_budget(documents, max_tokens: int = EMBED_TOKEN_BUDGET,
+                           max_items: int = EMBED_BATCH_SIZE):
+    """
+    Yield document batches whose summed token counts fit one embeddings call
+
+    A fixed item count is unsafe with large chunks: 512 chunks of 3000
+    tokens sums to ~1.5M, far past the endpoint's 300k-token request cap.
+    Batches are bounded by both the token budget and the item limit.
+    """
+    batch = []
+    batch_tokens = 0
+    for doc in documents:
+        tokens = _doc_token_count(doc)
+        if batch and (batch_tokens + tokens > max_tokens or len(batch) >= max_items):
+            yield batch
+            batch = []
+            batch_tokens = 0
+        batch.append(doc)
+        batch_tokens += tokens
+    if batch:
+        yield batch
+
+
+async def stream_embed_and_upsert(chunk_iter, index_name, namespace='',
+                                  num_workers=4, on_chunk=None) -> int:
+    """
+    Embed and upsert chunks as a producer-consumer pipeline
+
+    A producer task drains the (sync) chunk iterator on a worker thread and
+    feeds a bounded asyncio.Queue; num_workers consumer tasks pull batches
+    off the queue, embed them, and upsert them. Chunking, embedding and
+    upserting overlap instead of running as strictly sequential stages.
+
+    Args:
+        chunk_iter: Iterable of document chunk objects
+        index_name (str): Name of the Pinecone index to upsert to
+        namespace (str): Optional namespace for organizing data
+        num_workers (int): Number of concurrent embed+upsert consumers
+        on_chunk: Optional callback invoked with each chunk as it streams by
+            (used for incremental reporting)
+
+    Returns:
+        int: Number of chunks embedded and upserted
+    """
+    # Bound the queue so a fast producer cannot re-materialize the corpus
+    queue = asyncio.Queue(maxsize=UPSERT_BATCH_SIZE * num_workers)
+    index = get_pinecone().Index(index_name)
+    total = 0
+
+    async def producer():
+        iterator = iter(chunk_iter)
+        while True:
+            # next() does blocking file I/O, so run it off the event loop
+            chunk = await asyncio.to_thread(next, iterator, None)
+            if chunk is None:
+                break
+            if on_chunk:
+                on_chunk(chunk)
+            await queue.put(chunk)
+        # One sentinel per worker so every consumer shuts down
+        for _ in range(num_workers):
+            await queue.put(None)
+
+    async def worker():
+        nonlocal total
+        done = False
+        while not done:
+            batch = []
+            batch_tokens = 0
+            # Flush on whichever bound hits first: the upsert batch size or
+            # the embeddings request's token budget
+            while len(batch) < UPSERT_BATCH_SIZE and batch_tokens < EMBED_TOKEN_BUDGET:
+                chunk = await queue.get()
+                if chunk is None:
+                    done = True
+                    break
+                batch.append(chunk)
+                batch_tokens += _doc_token_count(chunk)
+            if not batch:
+                break
+
+            embeddings = await generate_embeddings([doc['text'] for doc in batch])
+            batch_ts = datetime.now().isoformat()
+            vectors = [{
+                'id': doc['doc_id'],
+                'values': embedding,
+                'metadata': _chunk_metadata(doc, batch_ts)
+            } for doc, embedding in zip(batch, embeddings)]
+            # index.upsert blocks; run it off the event loop so other
+            # workers and the producer keep moving
+            await asyncio.to_thread(_upsert_batch, index, vectors, namespace)
+            total += len(batch)
+            print(f"✅ Upserted batch of {len(batch)} vectors")
+
+    await asyncio.gather(producer(), *[worker() for _ in range(num_workers)])
+    return total
+
+
+def write_report_chunk(f, chunk_number: int, doc: Dict[str, Any]) -> None:
+    """Write one chunk's detail entry to the review report in a single write"""
+    parts = [
+        f"### CHUNK {chunk_number}\n\n",
+        f"- **ID:** {doc['doc_id']}\n",
+        f"- **Patient ID:** {doc['patient_id']}\n",
+        f"- **Type:** {doc['type']}\n",
+        f"- **Source File:** {doc['source_file']}\n",
+        f"- **Token Count:** {doc['token_count']}\n",
+        f"- **Chunk Index:** {doc['chunk_index']+1} of {doc['total_chunks']}\n",
+        f"- **Complete Document:** {doc.get('is_complete_document', False)}\n",
+        f"- **Timestamp:** {doc['timestamp']}\n\n",
+        f"**Text Preview (first 300 chars):**\n",
+        f"```\n{doc['text'][:300]}...\n```\n\n",
+        f"**Full Text:**\n",
+        f"```\n{doc['text']}\n```\n\n",
+        "---\n\n",
+    ]
+    f.write("".join(parts))
+
+
+def write_report_summary(f, files_summary: Dict[str, List[Dict[str, Any]]],
+                         total_chunks: int) -> None:
+    """Write the per-file summary section of the review report in a single write"""
+    parts = [
+        "## FILES SUMMARY\n\n",
+        f"**Total document chunks:** {total_chunks}  \n\n",
+    ]
+    for filename, chunks in files_summary.items():
+        total_tokens = sum(chunk['token_count'] for chunk in chunks)
+        parts.append(f"📄 **{filename}:** {len(chunks)} chunks, {total_tokens} total tokens  \n")
+        if len(chunks) == 1 and chunks[0].get('is_complete_document'):
+            parts.append(f"└── Single complete document\n\n")
+        else:
+            parts.append(f"└── Split into {len(chunks)} chunks\n\n")
+    f.write("".join(parts))
+
+
+
+def write_report(all_docs: List[Dict[str, Any]], output_file: str) -> None:
+    """
+    Write the full review report for an in-memory list of document chunks
+
+    Args:
+        all_docs (List[Dict[str, Any]]): Processed document chunks
+        output_file (str): Path of the markdown report to write
+    """
+    try:
+        with open(output_file, 'w', encoding='utf-8') as f:
+            f.write("# PROCESSED DOCUMENTS SUMMARY\n\n")
+            f.write(f"**Generated on:** {datetime.now().strftime('%Y-%m-%d %H:%M:%S')}\n\n")
+
+            # Group by source file for better overview
+            files_summary = defaultdict(list)
+            for doc in all_docs:
+                files_summary[doc['source_file']].append(doc)
+
+            write_report_summary(f, files_summary, len(all_docs))
+
+            f.write("---\n\n")
+            f.write("## DETAILED DOCUMENT CHUNKS\n\n")
+            for i, doc in enumerate(all_docs):
+                write_report_chunk(f, i + 1, doc)
+
+        print(f"✅ Document review file saved: {output_file}")
+
+    except Exception as error:
+        print(f"❌ Error saving document review file: {error}")
+
+
 if __name__ == "__main__":
     # Option 1: Count tokens in all files (for analysis)
     print("🔍 Token Analysis:")
@@ -304,70 +658,25 @@ if __name__ == "__main__":
     print(f"\n📋 Final Results:")
     print(f"Total document chunks: {len(all_docs)}")
     # Save all_docs to a text file for review
-    output_file = f"processed_documents_{datetime.now().strftime('%Y%m%d_%H%M%S')}.md"
-    try:
-        with open(output_file, 'w', encoding='utf-8') as f:
-            f.write("# PROCESSED DOCUMENTS SUMMARY\n\n")
-            f.write(f"**Total document chunks:** {len(all_docs)}  \n")
-            f.write(f"**Generated on:** {datetime.now().strftime('%Y-%m-%d %H:%M:%S')}\n\n")
-            
-            # Group by source file for better overview
-            from collections import defaultdict
-            files_summary = defaultdict(list)
-            for doc in all_docs:
-                files_summary[doc['source_file']].append(doc)
-            
-            f.write("## FILES SUMMARY\n\n")
-            for filename, chunks in files_summary.items():
-                total_tokens = sum(chunk['token_count'] for chunk in chunks)
-                f.write(f"📄 **{filename}:** {len(chunks)} chunks, {total_tokens} total tokens  \n")
-                if len(chunks) == 1 and chunks[0].get('is_complete_document'):
-                    f.write(f"└── Single complete document\n\n")
-                else:
-                    f.write(f"└── Split into {len(chunks)} chunks\n\n")
-            
-            f.write("---\n\n")
-            f.write("## DETAILED DOCUMENT CHUNKS\n\n")
-            
-            # Write detailed information for each document
-            for i, doc in enumerate(all_docs):
-                f.write(f"### CHUNK {i+1}\n\n")
-                f.write(f"- **ID:** {doc['doc_id']}\n")
-                f.write(f"- **Patient ID:** {doc['patient_id']}\n")
-                f.write(f"- **Type:** {doc['type']}\n")
-                f.write(f"- **Source File:** {doc['source_file']}\n")
-                f.write(f"- **Token Count:** {doc['token_count']}\n")
-                f.write(f"- **Chunk Index:** {doc['chunk_index']+1} of {doc['total_chunks']}\n")
-                f.write(f"- **Complete Document:** {doc.get('is_complete_document', False)}\n")
-                f.write(f"- **Timestamp:** {doc['timestamp']}\n\n")
-                f.write(f"**Text Preview (first 300 chars):**\n")
-                f.write(f"```\n{doc['text'][:300]}...\n```\n\n")
-                f.write(f"**Full Text:**\n")
-                f.write(f"```\n{doc['text']}\n```\n\n")
-                f.write("---\n\n")
-        
-        print(f"✅ Document review file saved: {output_file}")
-        
-    except Exception as error:
-        print(f"❌ Error saving document review file: {error}")
+    write_report(all_docs, f"processed_documents_{datetime.now().strftime('%Y%m%d_%H%M%S')}.md")
 
 ########################################################################################
 
-def create_index_if_not_exists(index_name: str, dimension: int = 1536):
+def create_index_if_not_exists(index_name: str, dimension: int = EMBEDDING_DIMENSIONS):
     """
     Create a Pinecone index if it doesn't already exist
-    
+
     Args:
         index_name (str): Name of the index to create
-        dimension (int): Dimension of the vectors (1536 for text-embedding-3-small)
+        dimension (int): Dimension of the vectors (must match EMBEDDING_DIMENSIONS)
     """
     try:
         # Check if index exists
-        existing_indexes = [index.name for index in pc.list_indexes()]
+        existing_indexes = [index.name for index in get_pinecone().list_indexes()]
         
         if index_name not in existing_indexes:
             print(f"🔨 Creating Pinecone index: {index_name}")
-            pc.create_index(
+            get_pinecone().create_index(
                 name=index_name,
                 dimension=dimension,
                 metric='cosine',
@@ -387,58 +696,75 @@ def create_index_if_not_exists(index_name: str, dimension: int = 1536):
         raise error
 
 
-def generate_embeddings(text: str) -> List[float]:
+async def generate_embeddings(texts: List[str]) -> List[List[float]]:
     """
-    Generate embeddings for the given text using OpenAI's embedding model
-    
+    Generate embeddings for a batch of texts using OpenAI's embedding model
+
+    The embeddings endpoint accepts a list input, so a single request returns
+    an embedding for every text instead of one round-trip per document.
+
     Args:
-        text (str): The text to generate embeddings for
-        
+        texts (List[str]): The texts to generate embeddings for
+
     Returns:
-        List[float]: The embedding vector
+        List[List[float]]: One embedding vector per input text, in input order
     """
-    try:
-        response = client.embeddings.create(
-            model="text-embedding-3-small",
-            input=text
-        )
-        return response.data[0].embedding
-    except Exception as error:
-        print(f"❌ Error generating embeddings: {error}")
-        raise error
+    for attempt in range(EMBED_MAX_RETRIES):
+        try:
+            # The semaphore keeps concurrent requests below the rate limit
+            async with _get_openai_semaphore():
+                response = await get_openai_client().embeddings.create(
+                    model="text-embedding-3-small",
+                    input=texts,
+                    dimensions=EMBEDDING_DIMENSIONS
+                )
+            return [item.embedding for item in response.data]
+        # Only transient failures are worth the backoff; 4xx client errors
+        # (bad key, malformed request) propagate immediately
+        except (openai.RateLimitError, openai.APIConnectionError,
+                openai.InternalServerError) as error:
+            if attempt == EMBED_MAX_RETRIES - 1:
+                print(f"❌ Error generating embeddings: {error}")
+                raise error
+            delay = min(2 ** attempt, 60)
+            print(f"⏳ Embedding request failed ({error}), retrying in {delay}s")
+            await asyncio.sleep(delay)
 
 
-async def save_to_pinecone(index_name: str, doc_id: str, embedding: List[float], 
-                          metadata: Dict[str, Any], namespace: str = '') -> None:
+def _chunk_metadata(doc: Dict[str, Any], batch_ts: str) -> Dict[str, Any]:
     """
-    Save embedding and metadata to Pinecone index
-    
+    Build the Pinecone metadata record for one document chunk
+
+    Shared by both upsert paths so every vector in the index carries the
+    same schema, including the section_path and h1-h3 header context the
+    two-stage splitter attaches (single-chunk documents have none).
+    """
+    return {
+        'patient_id': doc['patient_id'],
+        'type': doc['type'],
+        'text_preview': doc['text'][:500],
+        'source_file': doc.get('source_file', ''),
+        'chunk_index': doc.get('chunk_index', 0),
+        'timestamp': batch_ts,
+        'section_path': doc.get('section_path', ''),
+        **{level: doc[level] for level in ('h1', 'h2', 'h3') if level in doc}
+    }
+
+
+def _upsert_batch(index, vectors: List[Dict[str, Any]], namespace: str = '') -> None:
+    """
+    Upsert one batch of vectors over an already-resolved index handle
+
     Args:
-        index_name (str): Name of the Pinecone index
-        doc_id (str): Unique identifier for the document
-        embedding (List[float]): The embedding vector
-        metadata (Dict[str, Any]): Metadata to store with the vector
+        index: Pinecone index handle (resolved once by the caller)
+        vectors (List[Dict[str, Any]]): Vectors to upsert
         namespace (str): Optional namespace for organizing data
     """
     try:
-        # Get the index
-        index = pc.Index(index_name)
-        
-        # Prepare the vector for upserting
-        vector = {
-            'id': doc_id,
-            'values': embedding,
-            'metadata': metadata
-        }
-        
-        # Upsert the vector
         if namespace:
-            index.upsert(vectors=[vector], namespace=namespace)
+            index.upsert(vectors=vectors, namespace=namespace)
         else:
-            index.upsert(vectors=[vector])
-            
-        print(f"✅ Successfully saved vector to Pinecone: {doc_id}")
-        
+            index.upsert(vectors=vectors)
     except Exception as error:
         print(f"❌ Error saving to Pinecone: {error}")
         raise error
@@ -455,24 +781,32 @@ async def embed_and_upsert_documents(documents, index_name, namespace=''):
     """
     try:
         print(f"🚀 Starting to embed and upsert {len(documents)} documents...")
-        
-        for doc in documents:
-            # Generate embedding for the document text
-            embedding = generate_embeddings(doc['text'])
-            
-            # Prepare metadata
-            metadata = {
-                'patient_id': doc['patient_id'],
-                'type': doc['type'],
-                'text': doc['text'],
-                'timestamp': datetime.now().isoformat()
-            }
-            
-            # Upsert to Pinecone
-            await save_to_pinecone(index_name, doc['doc_id'], embedding, metadata, namespace)
-            
-            print(f"✅ Embedded and upserted document: {doc['doc_id']} ({doc['type']})")
-        
+
+        # Batch chunk texts by token budget into a few embedding requests
+        # and run the batches concurrently instead of one round-trip after
+        # another
+        batches = await asyncio.gather(*[
+            generate_embeddings([doc['text'] for doc in doc_batch])
+            for doc_batch in _batch_by_token_budget(documents)
+        ])
+        embeddings = [embedding for batch in batches for embedding in batch]
+
+        # Build every vector, then upsert them 100 at a time over a single
+        # index handle instead of one request per document
+        batch_ts = datetime.now().isoformat()
+        vectors = [{
+            'id': doc['doc_id'],
+            'values': embedding,
+            'metadata': _chunk_metadata(doc, batch_ts)
+        } for doc, embedding in zip(documents, embeddings)]
+
+        # Resolve the index handle once for the whole run
+        index = get_pinecone().Index(index_name)
+        for start in range(0, len(vectors), UPSERT_BATCH_SIZE):
+            batch = vectors[start:start + UPSERT_BATCH_SIZE]
+            await asyncio.to_thread(_upsert_batch, index, batch, namespace)
+            print(f"✅ Upserted batch of {len(batch)} vectors")
+
         print("🎉 All documents successfully embedded and upserted!")
     except Exception as error:
         print(f"❌ Error embedding and upserting documents: {error}")
@@ -483,85 +817,67 @@ async def embed_and_upsert_documents(documents, index_name, namespace=''):
 async def main():
     """Main function to process markdown files and embed them to Pinecone"""
     index_name = "client-documents"  # Replace with your actual index name
-    
-    print("📚 Processing All Documents:")
-    all_docs = process_all_markdown_files_in_folder(
-        folder_path='_Ethan Rodriguez', 
-        patient_id='6789',  # You can set this or let it auto-extract
-        chunk_size=3000,    # Adjust based on your needs
-        chunk_overlap=200   # Overlap for context preservation
-    )
-    
-    if not all_docs:
-        print("❌ No documents found to process")
-        return
-    
-    # Display summary of processed documents
-    print(f"\n📋 Final Results:")
-    print(f"Total document chunks: {len(all_docs)}")
-    
+    patient_id = '6789'  # You can set this or let it auto-extract
+
     # Create index if it doesn't exist
-    print(f"\n🔨 Setting up Pinecone index: {index_name}")
+    print(f"🔨 Setting up Pinecone index: {index_name}")
     create_index_if_not_exists(index_name)
-    
+
     # Wait a moment for index to be ready
     import time
     time.sleep(5)
-    
-    # Use patient_id from first document as namespace
-    namespace = all_docs[0]['patient_id'] if all_docs else ''
-    
-    # Embed and upsert all document chunks
-    print(f"\n🚀 Starting embedding and upserting process...")
-    await embed_and_upsert_documents(all_docs, index_name, namespace)
-    
-    # Save all_docs to a text file for review
+
+    # Stream chunks straight into the embed/upsert pipeline; the review
+    # report is written incrementally as each chunk flows through, so the
+    # corpus is never held in memory as one big list
     output_file = f"processed_documents_{datetime.now().strftime('%Y%m%d_%H%M%S')}.md"
+    print("📚 Processing All Documents:")
     try:
         with open(output_file, 'w', encoding='utf-8') as f:
             f.write("# PROCESSED DOCUMENTS SUMMARY\n\n")
-            f.write(f"**Total document chunks:** {len(all_docs)}  \n")
             f.write(f"**Generated on:** {datetime.now().strftime('%Y-%m-%d %H:%M:%S')}\n\n")
-            
-            # Group by source file for better overview
-            from collections import defaultdict
+            f.write("## DETAILED DOCUMENT CHUNKS\n\n")
+
+            # Per-file stats for the trailing summary (no chunk text kept)
             files_summary = defaultdict(list)
-            for doc in all_docs:
-                files_summary[doc['source_file']].append(doc)
-            
-            f.write("## FILES SUMMARY\n\n")
-            for filename, chunks in files_summary.items():
-                total_tokens = sum(chunk['token_count'] for chunk in chunks)
-                f.write(f"📄 **{filename}:** {len(chunks)} chunks, {total_tokens} total tokens  \n")
-                if len(chunks) == 1 and chunks[0].get('is_complete_document'):
-                    f.write(f"└── Single complete document\n\n")
-                else:
-                    f.write(f"└── Split into {len(chunks)} chunks\n\n")
-            
+            chunks_seen = 0
+
+            def on_chunk(doc):
+                nonlocal chunks_seen
+                chunks_seen += 1
+                files_summary[doc['source_file']].append({
+                    'token_count': doc['token_count'],
+                    'is_complete_document': doc['is_complete_document']
+                })
+                write_report_chunk(f, chunks_seen, doc)
+
+            print(f"\n🚀 Starting embedding and upserting process...")
+            total = await stream_embed_and_upsert(
+                iter_markdown_chunks(
+                    folder_path='_Ethan Rodriguez',
+                    patient_id=patient_id,
+                    chunk_size=3000,    # Adjust based on your needs
+                    chunk_overlap=200   # Overlap for context preservation
+                ),
+                index_name,
+                namespace=patient_id,
+                on_chunk=on_chunk
+            )
+
+            # Summary goes last so the detail entries above could stream
             f.write("---\n\n")
-            f.write("## DETAILED DOCUMENT CHUNKS\n\n")
-            
-            # Write detailed information for each document
-            for i, doc in enumerate(all_docs):
-                f.write(f"### CHUNK {i+1}\n\n")
-                f.write(f"- **ID:** {doc['doc_id']}\n")
-                f.write(f"- **Patient ID:** {doc['patient_id']}\n")
-                f.write(f"- **Type:** {doc['type']}\n")
-                f.write(f"- **Source File:** {doc['source_file']}\n")
-                f.write(f"- **Token Count:** {doc['token_count']}\n")
-                f.write(f"- **Chunk Index:** {doc['chunk_index']+1} of {doc['total_chunks']}\n")
-                f.write(f"- **Complete Document:** {doc.get('is_complete_document', False)}\n")
-                f.write(f"- **Timestamp:** {doc['timestamp']}\n\n")
-                f.write(f"**Text Preview (first 300 chars):**\n")
-                f.write(f"```\n{doc['text'][:300]}...\n```\n\n")
-                f.write(f"**Full Text:**\n")
-                f.write(f"```\n{doc['text']}\n```\n\n")
-                f.write("---\n\n")
-        
+            write_report_summary(f, files_summary, total)
+
+        if total == 0:
+            print("❌ No documents found to process")
+            return
+
+        print(f"\n📋 Final Results:")
+        print(f"Total document chunks: {total}")
         print(f"✅ Document review file saved: {output_file}")
-        
+
     except Exception as error:
-        print(f"❌ Error saving document review file: {error}")
+        print(f"❌ Error processing documents: {error}")
 
 
 if __name__ == "__main__":
@@ -56,10 +56,11 @@ try {
  * 
  * @param {string} text - The input text to convert to embeddings
  * @param {string} model - OpenAI embedding model to use (default: text-embedding-3-small)
- * @param {number|null} dimensions - Optional dimension reduction for newer models
+ * @param {number|null} dimensions - Dimension reduction for newer models
+ *   (default 512, matching the shared index; pass null for the model default)
  * @returns {Object} Object containing embedding vector, model info, and usage stats
  */
-async function generateEmbeddings(text, model = 'text-embedding-3-small', dimensions = null) {
+async function generateEmbeddings(text, model = 'text-embedding-3-small', dimensions = 512) {
   logRAG('🔍 GENERATING EMBEDDINGS', {
     text_length: text.length,
     model: model,
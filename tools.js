@@ -106,6 +106,13 @@ const tools = [
   }
 ];
 
+/**
+ * Embedding dimension used across the RAG system
+ * Must match the dimension the ingestion scripts (doc_loader.py,
+ * _misc/test_docs.py) embed with and the Pinecone index was created with
+ */
+const EMBEDDING_DIMENSIONS = 512;
+
 /**
  * Internal function to generate embeddings for the query
  * Not exposed to the LLM - used internally by the retrieval function
@@ -118,7 +125,8 @@ async function generateQueryEmbedding(query, model = 'text-embedding-3-small') {
 
     const response = await openaiClient.embeddings.create({
       input: query,
-      model: model
+      model: model,
+      dimensions: EMBEDDING_DIMENSIONS
     });
 
     return response.data[0].embedding;